@@ -9,6 +9,8 @@ from typing import Dict, List, Optional, Tuple
 
 from rich.console import Console
 
+from .tools.fs import atomic_write
+
 console = Console()
 
 
@@ -445,7 +447,7 @@ def save_codemap(content: str, output_path: str) -> bool:
     """Save CODEMAP.md to file."""
     
     try:
-        Path(output_path).write_text(content, encoding='utf-8')
+        atomic_write(output_path, content.encode('utf-8'))
         console.print(f"[green]CODEMAP.md saved to:[/green] {output_path}")
         return True
     except Exception as e:
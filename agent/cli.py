@@ -1,7 +1,6 @@
 """Main CLI module for the Local Coding Agent."""
 
 import sys
-from pathlib import Path
 from typing import Optional
 
 import typer
@@ -39,7 +38,7 @@ def whoami():
         table.add_row("LLM Base URL", config.llm_base_url)
         table.add_row("LLM Model", config.llm_model)
         table.add_row("API Key", f"{'*' * (len(config.llm_api_key) - 4)}{config.llm_api_key[-4:]}")
-        table.add_row("Work Directory", str(config.agent_workdir.absolute()))
+        table.add_row("Work Directory", str(config.workdir_resolved))
         table.add_row("Log Directory", str(config.agent_log_dir.absolute()))
         table.add_row("State File", str(config.agent_state.absolute()))
         
@@ -58,15 +57,10 @@ def analyze(path: Optional[str] = typer.Argument(None, help="Path to analyze (de
         
         # Import analyze tools
         from .analyze import analyze_project, generate_codemap, save_codemap
+        from .tools.fs import resolve_workdir_path
         
         # Determine target directory
-        if path:
-            if not Path(path).is_absolute():
-                target_dir = config.agent_workdir / path
-            else:
-                target_dir = Path(path)
-        else:
-            target_dir = config.agent_workdir
+        target_dir = resolve_workdir_path(path, config.workdir_resolved) if path else config.workdir_resolved
         
         if not target_dir.exists():
             console.print(f"[red]Error:[/red] Directory '{target_dir}' does not exist")
@@ -113,13 +107,16 @@ def ask(question: str = typer.Argument(..., help="Question to ask the LLM")):
         # Create LLM client
         llm = create_llm_client(config)
         
-        # Ask question
+        # Ask question, printing the response as it streams in
         console.print("[blue]Asking LLM...[/blue]")
-        response = llm.ask_question(question)
+        console.print("\n[green]Response:[/green]")
+        response = llm.ask_question(
+            question,
+            on_delta=lambda delta: console.out(delta, end="", highlight=False)
+        )
         
         if response:
-            console.print("\n[green]Response:[/green]")
-            console.print(response)
+            console.out("")
         else:
             console.print("[red]Failed to get response from LLM[/red]")
             raise typer.Exit(1)
@@ -191,7 +188,7 @@ def run(command: str = typer.Argument(..., help="Shell command to execute")):
                 return
         
         # Execute command
-        result = execute_command(command, str(config.agent_workdir))
+        result = execute_command(command, str(config.workdir_resolved), close_fds=not config.agent_fast_spawn)
         
         # Log the command
         log_command(result, config.agent_log_dir)
@@ -217,7 +214,7 @@ def write(
         
         # Import tools
         from .llm import create_llm_client
-        from .tools.fs import safe_write
+        from .tools.fs import resolve_workdir_path, safe_write
         
         # Create LLM client
         llm = create_llm_client(config)
@@ -231,10 +228,7 @@ def write(
             raise typer.Exit(1)
         
         # Convert relative path to absolute if needed
-        if not Path(path).is_absolute():
-            full_path = config.agent_workdir / path
-        else:
-            full_path = Path(path)
+        full_path = resolve_workdir_path(path, config.workdir_resolved)
         
         # Write file
         success = safe_write(str(full_path), content, overwrite)
@@ -258,15 +252,12 @@ def edit(
         
         # Import tools
         from .llm import create_llm_client
-        from .tools.fs import read_file_safe
-        from .tools.patch import validate_patch, display_patch, parse_unified_diff, apply_patch_to_file, create_backup
+        from .tools.fs import read_file_safe, resolve_workdir_path
+        from .tools.patch import validate_patch, display_patch, apply_patch_to_file, create_backup
         from rich.prompt import Confirm
         
         # Convert relative path to absolute if needed
-        if not Path(path).is_absolute():
-            full_path = config.agent_workdir / path
-        else:
-            full_path = Path(path)
+        full_path = resolve_workdir_path(path, config.workdir_resolved)
         
         # Read current file content
         current_content = read_file_safe(str(full_path))
@@ -300,10 +291,10 @@ def edit(
         
         # Create backup
         backup_dir = config.agent_state.parent / "backups"
-        create_backup(str(full_path), backup_dir)
+        create_backup(str(full_path), backup_dir, hardlink=True)
         
-        # Parse and apply patch
-        files_data = parse_unified_diff(patch_content)
+        # Apply the patch parsed during validation
+        files_data = validation.files
         if files_data:
             result = apply_patch_to_file(str(full_path), files_data[0])
             if result.success:
@@ -330,13 +321,10 @@ def delete(
         config = get_config()
         
         # Import file system tools
-        from .tools.fs import safe_delete
+        from .tools.fs import resolve_workdir_path, safe_delete
         
         # Convert relative path to absolute if needed
-        if not Path(path).is_absolute():
-            full_path = config.agent_workdir / path
-        else:
-            full_path = Path(path)
+        full_path = resolve_workdir_path(path, config.workdir_resolved)
         
         # Execute deletion
         success = safe_delete(str(full_path), yes)
@@ -396,7 +384,7 @@ def patch(
         # Apply patch if requested
         if apply or Confirm.ask("Apply this patch?"):
             console.print("[blue]Applying patch...[/blue]")
-            results = apply_patch_file(patch_file, config.agent_workdir)
+            results = apply_patch_file(patch_file, config.workdir_resolved, files_data=validation.files)
             
             success_count = sum(1 for r in results if r.success)
             total_count = len(results)
@@ -405,9 +393,8 @@ def patch(
                 console.print(f"[green]Patch applied successfully to {success_count} file(s)[/green]")
             else:
                 console.print(f"[yellow]Patch partially applied: {success_count}/{total_count} files[/yellow]")
-                for result in results:
-                    if not result.success:
-                        console.print(f"[red]Failed: {result.message}[/red]")
+                failures = "\n".join(f"Failed: {result.message}" for result in results if not result.success)
+                console.print(failures, style="red", markup=False)
         
     except Exception as e:
         console.print(f"[red]Error:[/red] {e}")
@@ -455,6 +442,7 @@ def todo_list():
         
         # Import tools
         from .state import create_state_manager, display_todos, generate_todo_markdown
+        from .tools.fs import atomic_write
         
         # Create state manager
         state_manager = create_state_manager(config.agent_state)
@@ -483,7 +471,7 @@ def todo_list():
         markdown_content = generate_todo_markdown(state.todos)
         todo_md_path = config.agent_state.parent / "TODO.md"
         try:
-            todo_md_path.write_text(markdown_content, encoding='utf-8')
+            atomic_write(todo_md_path, markdown_content.encode('utf-8'))
             console.print(f"[dim]Markdown version saved to: {todo_md_path}[/dim]")
         except Exception as e:
             console.print(f"[yellow]Warning: Failed to save TODO.md: {e}[/yellow]")
@@ -1,6 +1,7 @@
 """Configuration management for the Local Coding Agent."""
 
 import os
+from functools import cached_property
 from pathlib import Path
 from typing import Optional
 
@@ -14,13 +15,36 @@ class AgentConfig(BaseModel):
     llm_api_key: str = Field(..., description="LLM API key")
     llm_base_url: str = Field(default="https://api.gapgpt.app/v1", description="LLM base URL")
     llm_model: str = Field(default="gpt-5o", description="LLM model name")
+    llm_max_concurrency: int = Field(default=8, description="Maximum concurrent LLM requests")
+    llm_requests_per_minute: int = Field(default=0, description="LLM request rate limit (0 = unlimited)")
+    llm_tokens_per_minute: int = Field(default=0, description="LLM token rate limit (0 = unlimited)")
+    llm_cache_enabled: bool = Field(default=False, description="Cache LLM responses")
+    llm_cache_path: Path = Field(default=Path("~/.agent/llm_cache.sqlite"), description="LLM response cache file")
+    llm_cache_ttl: int = Field(default=86400, description="LLM response cache lifetime in seconds")
+    llm_cache_max_entries: int = Field(default=1000, description="Maximum cached LLM responses")
+    llm_cache_control: bool = Field(default=False, description="Mark prompt prefixes with cache_control hints")
+    llm_embedding_model: str = Field(default="", description="Embedding model for semantic cache hits (empty = disabled)")
     agent_workdir: Path = Field(default=Path("."), description="Agent working directory")
     agent_log_dir: Path = Field(default=Path(".agent/logs"), description="Agent log directory")
     agent_state: Path = Field(default=Path(".agent/state.json"), description="Agent state file")
+    agent_fast_spawn: bool = Field(default=False, description="Let commands inherit open file descriptors (skips close_fds)")
     
     class Config:
         """Pydantic config."""
         arbitrary_types_allowed = True
+    
+    @cached_property
+    def workdir_resolved(self) -> Path:
+        """Working directory with symlinks resolved, computed once per config and shared by all commands."""
+        return self.agent_workdir.resolve()
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    """Read a boolean environment variable."""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off")
 
 
 def load_config() -> AgentConfig:
@@ -40,9 +64,19 @@ def load_config() -> AgentConfig:
         llm_api_key=api_key,
         llm_base_url=os.getenv("LLM_BASE_URL", "https://api.gapgpt.app/v1"),
         llm_model=os.getenv("LLM_MODEL", "gpt-5o"),
+        llm_max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        llm_requests_per_minute=int(os.getenv("LLM_RPM", "0")),
+        llm_tokens_per_minute=int(os.getenv("LLM_TPM", "0")),
+        llm_cache_enabled=_env_flag("LLM_CACHE", False),
+        llm_cache_path=Path(os.getenv("LLM_CACHE_PATH", "~/.agent/llm_cache.sqlite")),
+        llm_cache_ttl=int(os.getenv("LLM_CACHE_TTL", "86400")),
+        llm_cache_max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+        llm_cache_control=_env_flag("LLM_CACHE_CONTROL", False),
+        llm_embedding_model=os.getenv("LLM_EMBEDDING_MODEL", ""),
         agent_workdir=Path(os.getenv("AGENT_WORKDIR", ".")),
         agent_log_dir=Path(os.getenv("AGENT_LOG_DIR", ".agent/logs")),
         agent_state=Path(os.getenv("AGENT_STATE", ".agent/state.json")),
+        agent_fast_spawn=_env_flag("AGENT_FAST_SPAWN", False),
     )
 
 
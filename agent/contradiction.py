@@ -1,5 +1,6 @@
 """Contradiction detection and reporting for the Local Coding Agent."""
 
+import re
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
@@ -8,6 +9,10 @@ from rich.console import Console
 
 console = Console()
 
+# Shell commands flagged by check_for_contradictions, matched case-insensitively in one scan
+DANGEROUS_COMMANDS = ["rm -rf /", "format", "shutdown", "reboot"]
+_DANGEROUS_COMMAND_RE = re.compile("|".join(map(re.escape, DANGEROUS_COMMANDS)), re.IGNORECASE)
+
 
 class ContradictionReport:
     """A contradiction report."""
@@ -121,8 +126,7 @@ def check_for_contradictions(command: str, args: dict, config_data: dict) -> Opt
     # Example: Running dangerous commands
     if command == "run":
         shell_command = args.get("command", "")
-        dangerous_commands = ["rm -rf /", "format", "shutdown", "reboot"]
-        if any(dangerous in shell_command.lower() for dangerous in dangerous_commands):
+        if _DANGEROUS_COMMAND_RE.search(shell_command):
             return ContradictionReport(
                 title="Dangerous Shell Command",
                 description=f"Attempting to run dangerous command: {shell_command}",
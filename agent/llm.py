@@ -1,150 +1,483 @@
 """LLM communication layer for the Local Coding Agent."""
 
+import asyncio
+import atexit
 import json
+import random
 import time
-from typing import Dict, List, Optional
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 
-from openai import OpenAI
+import httpx
 from rich.console import Console
 
 from .config import AgentConfig
+from .llm_cache import LLMCache, create_llm_cache
+from .prompts import (
+    FILE_EDIT_PROMPT,
+    FILE_GENERATION_PROMPT,
+    MULTI_FILE_PATCH_PROMPT,
+    PLANNING_PROMPT,
+    SYSTEM_PROMPT,
+    format_file_edit_prompt,
+    format_file_generation_prompt,
+    format_multi_file_patch_prompt,
+    format_planning_prompt,
+    normalize_prompt,
+)
+
+if TYPE_CHECKING:
+    # openai takes a few hundred ms to import; it is loaded when the first client is built
+    from openai import AsyncOpenAI
 
 console = Console()
 
+T = TypeVar("T")
+
+# Connection pool sized for ask_many fan-out; the SDK default pool stalls under high concurrency.
+# Idle connections are kept alive so later requests skip the TCP+TLS handshake.
+# Connects fail fast; reads keep the SDK's 600 s default for long, non-streamed completions.
+HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+
+# Process-wide clients keyed by (base_url, api_key) so the connection pool is shared
+_clients: Dict[Tuple[str, str], "AsyncOpenAI"] = {}
+
+# Event loop shared by synchronous callers; pooled connections are bound to the loop that opened them
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """Build the HTTP/2 transport used for LLM requests."""
+    return httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=True)
+
+
+def get_client(base_url: str, api_key: str) -> "AsyncOpenAI":
+    """Get the shared client for an endpoint, creating it on first use."""
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        from openai import AsyncOpenAI
+        
+        client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=build_http_client()
+        )
+        _clients[key] = client
+    return client
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """Run a coroutine to completion on the shared event loop."""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+@atexit.register
+def close_clients() -> None:
+    """Close pooled connections and the shared event loop."""
+    if _loop is None or _loop.is_closed():
+        _clients.clear()
+        return
+    
+    for client in _clients.values():
+        try:
+            _loop.run_until_complete(client.close())
+        except Exception:
+            pass  # Connections are torn down with the process anyway
+    _clients.clear()
+    _loop.close()
+
+
+def build_messages(system: str, context: str, user: str,
+                   cache_control: bool = False) -> List[Dict]:
+    """Assemble chat messages with the immutable prefix first.
+    
+    The system prompt and workspace context form a single, whitespace-normalized
+    system message so repeated calls share a byte-identical prefix that vendors
+    can serve from their prompt cache; only the user turn varies. OpenAI caches
+    such prefixes automatically, while ``cache_control`` adds the explicit
+    ephemeral marker expected by Anthropic-style endpoints.
+    """
+    prefix = normalize_prompt(system)
+    if context:
+        prefix = f"{prefix}\n\n{normalize_prompt(context)}"
+    
+    system_message = {"role": "system", "content": prefix}
+    if cache_control:
+        system_message["cache_control"] = {"type": "ephemeral"}
+    
+    return [system_message, {"role": "user", "content": user}]
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """Roughly estimate the prompt size of chat messages (~4 characters per token)."""
+    return sum(len(message["content"]) for message in messages) // 4
+
+
+class TokenBucket:
+    """Token bucket enforcing requests-per-minute and tokens-per-minute limits."""
+    
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.last_refill = time.monotonic()
+    
+    def _refill(self) -> None:
+        """Refill both buckets proportionally to the time elapsed."""
+        now = time.monotonic()
+        elapsed_minutes = (now - self.last_refill) / 60
+        self.last_refill = now
+        
+        if self.requests_per_minute:
+            self.available_requests = min(
+                float(self.requests_per_minute),
+                self.available_requests + elapsed_minutes * self.requests_per_minute
+            )
+        if self.tokens_per_minute:
+            self.available_tokens = min(
+                float(self.tokens_per_minute),
+                self.available_tokens + elapsed_minutes * self.tokens_per_minute
+            )
+    
+    async def acquire(self, tokens: int) -> None:
+        """Wait until there is capacity for one request of the given size."""
+        if self.tokens_per_minute:
+            # A single request larger than the whole bucket would otherwise wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        
+        while True:
+            self._refill()
+            
+            wait = 0.0
+            if self.requests_per_minute and self.available_requests < 1:
+                wait = (1 - self.available_requests) * 60 / self.requests_per_minute
+            if self.tokens_per_minute and self.available_tokens < tokens:
+                wait = max(wait, (tokens - self.available_tokens) * 60 / self.tokens_per_minute)
+            
+            if wait <= 0:
+                if self.requests_per_minute:
+                    self.available_requests -= 1
+                if self.tokens_per_minute:
+                    self.available_tokens -= tokens
+                return
+            
+            await asyncio.sleep(wait)
+
 
 class LLMClient:
     """Client for communicating with LLM APIs."""
     
     def __init__(self, config: AgentConfig):
         self.config = config
-        self.client = OpenAI(
-            api_key=config.llm_api_key,
-            base_url=config.llm_base_url
-        )
+        self.client = get_client(config.llm_base_url, config.llm_api_key)
         self.model = config.llm_model
+        self.rate_limiter = TokenBucket(
+            requests_per_minute=config.llm_requests_per_minute,
+            tokens_per_minute=config.llm_tokens_per_minute
+        )
+        # Created lazily so the semaphore binds to the loop that actually runs the requests
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        # Responses are only reusable for the same model and endpoint
+        self.cache_params = {"model": self.model, "base_url": config.llm_base_url}
+        self.cache: Optional[LLMCache] = None
+        if config.llm_cache_enabled:
+            self.cache = create_llm_cache(
+                config.llm_cache_path,
+                ttl=config.llm_cache_ttl,
+                max_entries=config.llm_cache_max_entries
+            )
+    
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Get the semaphore bounding concurrent LLM requests."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.config.llm_max_concurrency))
+        return self._semaphore
+    
+    def cache_key(self, messages: List[Dict[str, str]]) -> str:
+        """Get the response cache key for a conversation sent by this client."""
+        return LLMCache.key_for(messages, self.cache_params)
     
-    def chat(self, messages: List[Dict[str, str]], max_retries: int = 3) -> Optional[str]:
-        """Send chat messages to LLM and get response."""
+    def cache_scope(self, messages: List[Dict[str, str]]) -> str:
+        """Get the semantic cache scope for a conversation sent by this client."""
+        return LLMCache.scope_for(messages, self.cache_params)
+    
+    def build_messages(self, system: str, context: str, user: str) -> List[Dict]:
+        """Assemble messages using the configured prompt-cache hints."""
+        return build_messages(system, context, user, cache_control=self.config.llm_cache_control)
+    
+    @property
+    def prompt_cache_hit_ratio(self) -> float:
+        """Share of prompt tokens served from the provider's prefix cache."""
+        return self.cached_prompt_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+    
+    def _record_usage(self, usage) -> None:
+        """Track prompt-cache hits reported by the provider."""
+        if usage is None:
+            return
         
-        for attempt in range(max_retries):
-            try:
-                console.print(f"[dim]Sending request to LLM (attempt {attempt + 1}/{max_retries})[/dim]")
-                
-                # Try responses.create first (if available)
+        prompt_tokens = getattr(usage, "input_tokens", None) or getattr(usage, "prompt_tokens", None)
+        details = getattr(usage, "input_tokens_details", None) or getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) if details else None
+        if cached_tokens is None:
+            # DeepSeek-style usage reporting
+            cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+        
+        if not prompt_tokens or cached_tokens is None:
+            return
+        
+        self.prompt_tokens += prompt_tokens
+        self.cached_prompt_tokens += cached_tokens
+        if not cached_tokens:
+            return  # Routine zero-hit reports would add noise to every command
+        
+        console.print(
+            f"[dim]Prompt cache: {cached_tokens}/{prompt_tokens} tokens "
+            f"(session hit ratio {self.prompt_cache_hit_ratio:.0%})[/dim]"
+        )
+    
+    async def _create(self, messages: List[Dict[str, str]]) -> Optional[str]:
+        """Issue a single completion request."""
+        from openai import BadRequestError, NotFoundError
+        
+        # Try responses.create first (if available)
+        try:
+            response = await self.client.responses.create(
+                model=self.model,
+                input=messages
+            )
+            self._record_usage(getattr(response, "usage", None))
+            return response.output_text
+        except (AttributeError, NotFoundError, BadRequestError):
+            # Fall back to chat.completions.create
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages
+            )
+            self._record_usage(getattr(response, "usage", None))
+            return response.choices[0].message.content
+    
+    async def _embed(self, messages: List[Dict[str, str]]) -> Optional[List[float]]:
+        """Embed the user turns of a conversation for semantic cache lookups."""
+        text = "\n".join(message["content"] for message in messages if message["role"] == "user")
+        try:
+            # Embedding calls count against the same request/token budget as completions
+            await self.rate_limiter.acquire(len(text) // 4)
+            response = await self.client.embeddings.create(
+                model=self.config.llm_embedding_model,
+                input=text
+            )
+            return response.data[0].embedding
+        except Exception as e:
+            console.print(f"[dim]Semantic cache lookup skipped: {e}[/dim]")
+            return None
+    
+    async def ask(self, messages: List[Dict[str, str]], max_retries: int = 5,
+                  raise_on_error: bool = False, use_cache: bool = True) -> Optional[str]:
+        """Send chat messages to LLM and get response, respecting concurrency and rate limits.
+        
+        Returns None once all retries fail, or re-raises the last error if
+        ``raise_on_error`` is set. ``use_cache=False`` always asks the model.
+        """
+        
+        cache = self.cache if use_cache else None
+        cache_key = self.cache_key(messages)
+        if cache:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                console.print("[dim]Using cached LLM response[/dim]")
+                return cached
+        
+        async with self._get_semaphore():
+            embedding = None
+            scope = self.cache_scope(messages)
+            if cache and self.config.llm_embedding_model:
+                embedding = await self._embed(messages)
+                if embedding:
+                    similar = cache.find_similar(scope, embedding)
+                    if similar is not None:
+                        console.print("[dim]Using cached LLM response for a similar prompt[/dim]")
+                        return similar
+            
+            for attempt in range(max_retries):
                 try:
-                    response = self.client.responses.create(
-                        model=self.model,
-                        messages=messages
-                    )
-                    return response.choices[0].message.content
-                except AttributeError:
-                    # Fall back to chat.completions.create
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages
-                    )
-                    return response.choices[0].message.content
-                
-            except Exception as e:
-                console.print(f"[yellow]LLM request failed (attempt {attempt + 1}): {e}[/yellow]")
-                if attempt < max_retries - 1:
-                    time.sleep(1)  # Brief delay before retry
-                else:
-                    console.print(f"[red]All LLM requests failed. Last error: {e}[/red]")
-                    console.print("[blue]Please check your LLM_API_KEY and LLM_BASE_URL configuration[/blue]")
-                    return None
-    
-    def ask_question(self, question: str, context: Optional[str] = None) -> Optional[str]:
-        """Ask a free-form question to the LLM."""
-        
-        messages = [
-            {
-                "role": "system",
-                "content": "تو یک ایجنت کدنویسی لوکال هستی؛ فقط در workspace تعیین‌شده کار کن؛ تغییرات را به صورت unified diff ارائه بده؛ پاسخ‌ها کوتاه و ایمن باشند."
-            }
-        ]
-        
-        if context:
-            messages.append({
-                "role": "system", 
-                "content": f"Context: {context}"
-            })
-        
-        messages.append({
-            "role": "user",
-            "content": question
-        })
+                    console.print(f"[dim]Sending request to LLM (attempt {attempt + 1}/{max_retries})[/dim]")
+                    await self.rate_limiter.acquire(estimate_tokens(messages))
+                    response = await self._create(messages)
+                    if response and cache:
+                        cache.put(cache_key, scope, response, embedding)
+                    return response
+                    
+                except Exception as e:
+                    console.print(f"[yellow]LLM request failed (attempt {attempt + 1}): {e}[/yellow]")
+                    if attempt < max_retries - 1:
+                        rate_limited = getattr(e, "status_code", None) == 429
+                        # Exponential backoff with jitter for rate limits, brief delay otherwise
+                        await asyncio.sleep(2 ** attempt + random.random() if rate_limited else 1)
+                    else:
+                        console.print(f"[red]All LLM requests failed. Last error: {e}[/red]")
+                        console.print("[blue]Please check your LLM_API_KEY and LLM_BASE_URL configuration[/blue]")
+                        if raise_on_error:
+                            raise
+                        return None
+        
+        return None
+    
+    async def ask_stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Yield the response text as it arrives instead of waiting for the full reply.
         
+        Unlike ``ask`` there are no retries, since part of the answer may already
+        have been consumed; errors propagate to the caller.
+        """
+        from openai import BadRequestError, NotFoundError
+        
+        cache_key = self.cache_key(messages)
+        if self.cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                console.print("[dim]Using cached LLM response[/dim]")
+                yield cached
+                return
+        
+        chunks = []
+        async with self._get_semaphore():
+            await self.rate_limiter.acquire(estimate_tokens(messages))
+            try:
+                stream = await self.client.responses.create(
+                    model=self.model,
+                    input=messages,
+                    stream=True
+                )
+                async for event in stream:
+                    if event.type == "response.output_text.delta":
+                        chunks.append(event.delta)
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        self._record_usage(getattr(event.response, "usage", None))
+            except (AttributeError, NotFoundError, BadRequestError):
+                if chunks:
+                    raise
+                # Fall back to streamed chat.completions
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=True
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        chunks.append(delta)
+                        yield delta
+        
+        if chunks and self.cache:
+            self.cache.put(cache_key, self.cache_scope(messages), "".join(chunks))
+    
+    async def ask_many(self, batch: List[List[Dict[str, str]]],
+                       raise_on_error: bool = False) -> List[Optional[str]]:
+        """Send several independent conversations concurrently.
+        
+        Callers should collect all prompts first (e.g. one per file) and submit
+        them here instead of awaiting ``ask`` in a loop; requests still respect
+        the concurrency and rate limits. Failed requests yield ``None`` unless
+        ``raise_on_error`` is set.
+        """
+        results = await asyncio.gather(
+            *[self.ask(messages, raise_on_error=raise_on_error) for messages in batch],
+            return_exceptions=True
+        )
+        
+        responses = []
+        for result in results:
+            if isinstance(result, BaseException):
+                if raise_on_error:
+                    raise result
+                console.print(f"[yellow]LLM batch request failed: {result}[/yellow]")
+                result = None
+            responses.append(result)
+        
+        return responses
+    
+    def ask_many_sync(self, batch: List[List[Dict[str, str]]],
+                      raise_on_error: bool = False) -> List[Optional[str]]:
+        """Synchronous wrapper around ``ask_many`` for CLI code paths."""
+        return run_sync(self.ask_many(batch, raise_on_error))
+    
+    def chat(self, messages: List[Dict[str, str]], use_cache: bool = True) -> Optional[str]:
+        """Send chat messages to LLM and get response, with ``ask``'s retry budget."""
+        return run_sync(self.ask(messages, use_cache=use_cache))
+    
+    def chat_stream(self, messages: List[Dict[str, str]],
+                    on_delta: Callable[[str], None]) -> Optional[str]:
+        """Stream a response to ``on_delta`` and return the full text."""
+        
+        async def consume() -> str:
+            chunks = []
+            async for delta in self.ask_stream(messages):
+                on_delta(delta)
+                chunks.append(delta)
+            return "".join(chunks)
+        
+        try:
+            return run_sync(consume()) or None
+        except Exception as e:
+            console.print(f"\n[red]LLM streaming request failed: {e}[/red]")
+            console.print("[blue]Please check your LLM_API_KEY and LLM_BASE_URL configuration[/blue]")
+            return None
+    
+    def ask_question(self, question: str, context: Optional[str] = None,
+                     on_delta: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """Ask a free-form question to the LLM, streaming to ``on_delta`` if given."""
+        
+        context_text = f"Context: {context}" if context else ""
+        messages = self.build_messages(SYSTEM_PROMPT, context_text, question)
+        
+        if on_delta:
+            return self.chat_stream(messages, on_delta)
         return self.chat(messages)
     
     def generate_file_content(self, description: str, file_path: str) -> Optional[str]:
         """Generate file content from description."""
         
-        messages = [
-            {
-                "role": "system",
-                "content": "توضیح را به فایل اجرایی تبدیل کن؛ ساختار ساده و مینیمال باشد."
-            },
-            {
-                "role": "user",
-                "content": f"Create a file at path '{file_path}' with the following description:\n\n{description}\n\nGenerate only the file content, no explanations."
-            }
-        ]
+        messages = self.build_messages(
+            FILE_GENERATION_PROMPT, "",
+            format_file_generation_prompt(description, file_path)
+        )
         
         return self.chat(messages)
     
     def generate_file_edit(self, file_content: str, file_path: str, instruction: str) -> Optional[str]:
         """Generate edit instructions for a file."""
         
-        messages = [
-            {
-                "role": "system",
-                "content": "فقط بخش‌های لازم تغییر کند؛ خروجی unified diff باشد."
-            },
-            {
-                "role": "user",
-                "content": f"File path: {file_path}\n\nCurrent content:\n```\n{file_content}\n```\n\nEdit instruction: {instruction}\n\nGenerate a unified diff patch for the changes. Only output the diff, no explanations."
-            }
-        ]
+        messages = self.build_messages(
+            FILE_EDIT_PROMPT, "",
+            format_file_edit_prompt(file_content, file_path, instruction)
+        )
         
-        return self.chat(messages)
+        # A retried edit should get a fresh diff, not replay the one just rejected
+        return self.chat(messages, use_cache=False)
     
     def generate_multi_file_patch(self, project_context: str, description: str) -> Optional[str]:
         """Generate a multi-file patch."""
         
-        messages = [
-            {
-                "role": "system",
-                "content": "پچ چندفایلی با مسیر نسبی از ریشهٔ پروژه بده؛ هر فایل در hunk جدا باشد."
-            },
-            {
-                "role": "user",
-                "content": f"Project context:\n{project_context}\n\nChanges needed:\n{description}\n\nGenerate a unified diff patch for multiple files. Use relative paths from project root."
-            }
-        ]
+        messages = self.build_messages(
+            MULTI_FILE_PATCH_PROMPT, "",
+            format_multi_file_patch_prompt(project_context, description)
+        )
         
-        return self.chat(messages)
+        # A retried patch should get a fresh diff, not replay the one just rejected
+        return self.chat(messages, use_cache=False)
     
     def create_plan(self, goal: str, context: Optional[str] = None) -> Optional[List[str]]:
         """Create a step-by-step plan for achieving a goal."""
         
-        messages = [
-            {
-                "role": "system",
-                "content": "یک برنامه‌ریز کدنویسی هستی. گام‌های عملی و قابل اجرا برای دستیابی به هدف ارائه بده."
-            }
-        ]
-        
-        if context:
-            messages.append({
-                "role": "system",
-                "content": f"Project context: {context}"
-            })
-        
-        messages.append({
-            "role": "user",
-            "content": f"Create a step-by-step plan to achieve this goal: {goal}\n\nReturn the plan as a JSON array of strings, where each string is a task step. Only return the JSON, no explanations."
-        })
+        context_text = f"Project context: {context}" if context else ""
+        messages = self.build_messages(PLANNING_PROMPT, context_text, format_planning_prompt(goal))
         
         response = self.chat(messages)
         if not response:
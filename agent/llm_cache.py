@@ -0,0 +1,152 @@
+"""Response cache for LLM requests of the Local Coding Agent."""
+
+import hashlib
+import json
+import math
+import operator
+import sqlite3
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from rich.console import Console
+
+console = Console()
+
+
+class LLMCache:
+    """Two-tier LLM response cache stored in SQLite.
+    
+    Exact hits are looked up by the SHA-256 of the serialized messages and the
+    request parameters (model, endpoint). When embeddings are supplied,
+    near-duplicate prompts within the same scope (identical parameters and
+    system/context messages) can be served by cosine similarity. Embeddings are
+    stored unit-normalized and only the ``max_scan`` most recently used rows of
+    a scope are compared, so a lookup costs one dot product per scanned row.
+    """
+    
+    def __init__(self, db_path: Path, ttl: float = 86400, max_entries: int = 1000,
+                 similarity_threshold: float = 0.97, max_scan: int = 100):
+        self.db_path = Path(db_path).expanduser()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.max_scan = max_scan
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.db_path))
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                scope TEXT NOT NULL,
+                response TEXT NOT NULL,
+                embedding BLOB,
+                norm REAL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_scope_recent ON responses (scope, last_used)")
+        self._conn.commit()
+    
+    @staticmethod
+    def key_for(messages: List[Dict[str, str]], params: Optional[Dict] = None) -> str:
+        """Get the exact-match cache key for a conversation sent with the given request parameters."""
+        serialized = json.dumps({"params": params or {}, "messages": messages}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def scope_for(messages: List[Dict[str, str]], params: Optional[Dict] = None) -> str:
+        """Get the semantic-match scope, i.e. the hash of the parameters and all non-user messages."""
+        return LLMCache.key_for([message for message in messages if message["role"] != "user"], params)
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return a fresh cached response for an exact key."""
+        row = self._conn.execute(
+            "SELECT response FROM responses WHERE key = ? AND created >= ?",
+            (key, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        self._touch(key)
+        return row[0]
+    
+    def find_similar(self, scope: str, embedding: Sequence[float]) -> Optional[str]:
+        """Return the most similar fresh response within a scope, if above the threshold."""
+        query_norm = math.sqrt(sum(x * x for x in embedding))
+        if not query_norm:
+            return None
+        
+        best_key = None
+        best_response = None
+        best_score = self.similarity_threshold
+        
+        rows = self._conn.execute(
+            "SELECT key, response, embedding, norm FROM responses "
+            "WHERE scope = ? AND embedding IS NOT NULL AND created >= ? "
+            "ORDER BY last_used DESC LIMIT ?",
+            (scope, time.time() - self.ttl, self.max_scan)
+        )
+        for key, response, blob, norm in rows:
+            vector = array("f")
+            vector.frombytes(blob)
+            if len(vector) != len(embedding) or not norm:
+                continue
+            
+            # Stored vectors are unit length (norm 1.0); older rows keep their raw norm
+            score = sum(map(operator.mul, vector, embedding)) / (norm * query_norm)
+            if score >= best_score:
+                best_key, best_response, best_score = key, response, score
+        
+        if best_key is not None:
+            self._touch(best_key)
+        return best_response
+    
+    def put(self, key: str, scope: str, response: str,
+            embedding: Optional[Sequence[float]] = None) -> None:
+        """Store a response and evict expired or least recently used entries."""
+        blob = None
+        norm = None
+        if embedding:
+            length = math.sqrt(sum(x * x for x in embedding))
+            if length:
+                blob = array("f", [x / length for x in embedding]).tobytes()
+                norm = 1.0
+        
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, scope, response, embedding, norm, created, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, scope, response, blob, norm, now, now)
+        )
+        self._evict(now)
+        self._conn.commit()
+    
+    def _touch(self, key: str) -> None:
+        """Record a cache hit for LRU eviction."""
+        self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+    
+    def _evict(self, now: float) -> None:
+        """Drop expired entries and trim the cache to its maximum size."""
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key NOT IN "
+            "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+    
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._conn.close()
+
+
+def create_llm_cache(db_path: Path, ttl: float = 86400, max_entries: int = 1000) -> Optional[LLMCache]:
+    """Create the response cache, or return None if the database cannot be opened."""
+    try:
+        return LLMCache(db_path, ttl=ttl, max_entries=max_entries)
+    except (OSError, sqlite3.Error) as e:
+        console.print(f"[yellow]Warning: LLM cache disabled: {e}[/yellow]")
+        return None
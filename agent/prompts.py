@@ -14,73 +14,94 @@ PLANNING_PROMPT = """یک برنامه‌ریز کدنویسی هستی. گام
 ANALYSIS_PROMPT = """یک تحلیلگر کد هستی. ساختار پروژه، فایل‌ها، کلاس‌ها و توابع را به صورت منظم تحلیل کن."""
 
 
+def normalize_prompt(text: str) -> str:
+    """Normalize whitespace so identical prompts stay byte-identical across calls."""
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+# Fixed instruction headers, built once at import time
+FILE_GENERATION_INSTRUCTIONS = "Generate only the file content, no explanations."
+
+FILE_EDIT_INSTRUCTIONS = "Generate a unified diff patch for the changes. Only output the diff, no explanations."
+
+MULTI_FILE_PATCH_INSTRUCTIONS = "Generate a unified diff patch for multiple files. Use relative paths from project root."
+
+PLANNING_INSTRUCTIONS = "Return the plan as a JSON array of strings, where each string is a task step. Only return the JSON, no explanations."
+
+ANALYSIS_INSTRUCTIONS = """Analyze this project structure and generate a comprehensive code map.
+
+Create a structured analysis including:
+1. Project overview
+2. File organization
+3. Programming languages used
+4. Key components and their purposes
+5. Dependencies and relationships
+
+Format the output as a well-structured Markdown document."""
+
+
+# Formatters put the fixed instructions first and the per-call data last, so the
+# longest possible prefix is shared between requests (vendor prompt caching).
+
 def format_file_generation_prompt(description: str, file_path: str) -> str:
     """Format prompt for file generation."""
-    return f"""Create a file at path '{file_path}' with the following description:
+    return f"""{FILE_GENERATION_INSTRUCTIONS}
 
-{description}
+File path: {file_path}
 
-Generate only the file content, no explanations."""
+Description:
+{description}"""
 
 
 def format_file_edit_prompt(file_content: str, file_path: str, instruction: str) -> str:
     """Format prompt for file editing."""
-    return f"""File path: {file_path}
+    return f"""{FILE_EDIT_INSTRUCTIONS}
+
+File path: {file_path}
 
 Current content:
 ```
 {file_content}
 ```
 
-Edit instruction: {instruction}
-
-Generate a unified diff patch for the changes. Only output the diff, no explanations."""
+Edit instruction: {instruction}"""
 
 
 def format_multi_file_patch_prompt(project_context: str, description: str) -> str:
     """Format prompt for multi-file patch generation."""
-    return f"""Project context:
+    return f"""{MULTI_FILE_PATCH_INSTRUCTIONS}
+
+Project context:
 {project_context}
 
 Changes needed:
-{description}
-
-Generate a unified diff patch for multiple files. Use relative paths from project root."""
+{description}"""
 
 
 def format_planning_prompt(goal: str, context: str = None) -> str:
     """Format prompt for plan creation."""
-    prompt = f"""Create a step-by-step plan to achieve this goal: {goal}
-
-Return the plan as a JSON array of strings, where each string is a task step. Only return the JSON, no explanations."""
+    prompt = PLANNING_INSTRUCTIONS
     
     if context:
-        prompt = f"""Project context: {context}
+        prompt = f"""{prompt}
 
-{prompt}"""
+Project context: {context}"""
     
-    return prompt
+    return f"""{prompt}
+
+Create a step-by-step plan to achieve this goal: {goal}"""
 
 
 def format_analysis_prompt(directory_path: str, file_list: list) -> str:
     """Format prompt for project analysis."""
-    files_text = "\n".join([f"- {f}" for f in file_list])
+    files_text = "\n".join(f"- {f}" for f in sorted(file_list))
     
-    return f"""Analyze this project structure and generate a comprehensive code map.
+    return f"""{ANALYSIS_INSTRUCTIONS}
 
 Directory: {directory_path}
 
 Files found:
-{files_text}
-
-Create a structured analysis including:
-1. Project overview
-2. File organization
-3. Programming languages used
-4. Key components and their purposes
-5. Dependencies and relationships
-
-Format the output as a well-structured Markdown document."""
+{files_text}"""
 
 
 def format_question_prompt(question: str, context: str = None) -> str:
@@ -1,14 +1,17 @@
 """State management for the Local Coding Agent."""
 
-import json
+import os
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 
-from pydantic import BaseModel
+import orjson
+from pydantic import BaseModel, PrivateAttr, TypeAdapter
 from rich.console import Console
 from rich.table import Table
 
+from .tools.fs import atomic_write
+
 console = Console()
 
 
@@ -27,10 +30,10 @@ class TodoItem(BaseModel):
         """Check if todo is completed."""
         return self.status == "completed"
     
-    def mark_completed(self):
+    def mark_completed(self, now: Optional[datetime] = None):
         """Mark todo as completed."""
         self.status = "completed"
-        self.completed = datetime.now()
+        self.completed = now or datetime.now()
     
     def mark_in_progress(self):
         """Mark todo as in progress."""
@@ -51,68 +54,155 @@ class AgentState(BaseModel):
     next_todo_id: int = 1
     metadata: Dict = {}
     
-    def add_todo(self, title: str, description: str = "") -> TodoItem:
+    # Index of todos by ID for O(1) lookups; kept in sync by the mutating methods
+    _todos_by_id: Dict[int, TodoItem] = PrivateAttr(default_factory=dict)
+    # IDs of todos not yet completed / completed, so status queries skip finished items
+    _open_ids: Dict[int, None] = PrivateAttr(default_factory=dict)
+    _completed_ids: Set[int] = PrivateAttr(default_factory=set)
+    # Changes not yet persisted, appended to the state journal on save
+    _journal: List[Dict] = PrivateAttr(default_factory=list)
+    
+    def model_post_init(self, __context) -> None:
+        """Build the TODO index after loading or construction."""
+        self._todos_by_id = {todo.id: todo for todo in self.todos}
+        self._open_ids = {todo.id: None for todo in self.todos if todo.status != "completed"}
+        self._completed_ids = {todo.id for todo in self.todos if todo.status == "completed"}
+    
+    def add_todo(self, title: str, description: str = "", now: Optional[datetime] = None) -> TodoItem:
         """Add a new TODO item."""
+        now = now or datetime.now()
         todo = TodoItem(
             id=self.next_todo_id,
             title=title,
             description=description,
-            created=datetime.now()
+            created=now
         )
         
         self.todos.append(todo)
+        self._todos_by_id[todo.id] = todo
+        self._open_ids[todo.id] = None
         self.next_todo_id += 1
-        self.last_updated = datetime.now()
+        self.last_updated = now
+        # A shallow copy of the field dict is all orjson needs; model_dump() would walk the serializers
+        self._journal.append({"op": "add", "todo": dict(todo.__dict__)})
         
         return todo
     
     def get_todo(self, todo_id: int) -> Optional[TodoItem]:
         """Get a TODO item by ID."""
-        for todo in self.todos:
-            if todo.id == todo_id:
-                return todo
-        return None
+        return self._todos_by_id.get(todo_id)
+    
+    def _get_open_todos(self) -> List[TodoItem]:
+        """Get the TODO items that are not completed, in ID order."""
+        return [self._todos_by_id[todo_id] for todo_id in self._open_ids]
     
     def get_pending_todos(self) -> List[TodoItem]:
         """Get all pending TODO items."""
-        return [todo for todo in self.todos if todo.status == "pending"]
+        return [todo for todo in self._get_open_todos() if todo.status == "pending"]
     
     def get_active_todos(self) -> List[TodoItem]:
         """Get all active (pending or in progress) TODO items."""
-        return [todo for todo in self.todos if todo.status in ["pending", "in_progress"]]
+        return [todo for todo in self._get_open_todos() if todo.status in ("pending", "in_progress")]
     
     def get_completed_todos(self) -> List[TodoItem]:
         """Get all completed TODO items."""
-        return [todo for todo in self.todos if todo.status == "completed"]
+        return [self._todos_by_id[todo_id] for todo_id in sorted(self._completed_ids)]
+    
+    def _index_completed(self, todo_id: int) -> None:
+        """Move a TODO from the open to the completed index."""
+        self._open_ids.pop(todo_id, None)
+        self._completed_ids.add(todo_id)
     
     def mark_todo_done(self, todo_id: int) -> bool:
         """Mark a TODO as completed."""
         todo = self.get_todo(todo_id)
         if todo:
-            todo.mark_completed()
-            self.last_updated = datetime.now()
+            now = datetime.now()
+            todo.mark_completed(now)
+            self._index_completed(todo_id)
+            self.last_updated = now
+            self._journal.append({"op": "done", "id": todo_id, "ts": now})
             return True
         return False
     
     def add_plan_todos(self, plan: List[str], goal_description: str = "") -> List[TodoItem]:
         """Add multiple TODOs from a plan."""
         added_todos = []
+        now = datetime.now()
+        description = f"Part of plan: {goal_description}" if goal_description else ""
         
         for i, step in enumerate(plan, 1):
             title = f"Step {i}: {step}" if len(plan) > 1 else step
-            description = f"Part of plan: {goal_description}" if goal_description else ""
             
-            todo = self.add_todo(title, description)
+            todo = self.add_todo(title, description, now)
             added_todos.append(todo)
         
         return added_todos
+    
+    def apply_event(self, event: Dict) -> None:
+        """Replay a journal event (idempotent, so a replayed journal is harmless)."""
+        if event.get("op") == "add":
+            todo = TodoItem(**event["todo"])
+            if todo.id in self._todos_by_id:
+                return
+            self.todos.append(todo)
+            self._todos_by_id[todo.id] = todo
+            if todo.status == "completed":
+                self._completed_ids.add(todo.id)
+            else:
+                self._open_ids[todo.id] = None
+            self.next_todo_id = max(self.next_todo_id, todo.id + 1)
+            self.last_updated = todo.created
+        
+        elif event.get("op") == "done":
+            todo = self.get_todo(event["id"])
+            if todo:
+                todo.status = "completed"
+                todo.completed = datetime.fromisoformat(event["ts"])
+                self._index_completed(todo.id)
+                self.last_updated = todo.completed
+    
+    def pop_journal(self) -> List[Dict]:
+        """Take the events recorded since the last save."""
+        events, self._journal = self._journal, []
+        return events
+    
+    def requeue_journal(self, events: List[Dict]) -> None:
+        """Put back events that could not be persisted, ahead of newer ones."""
+        self._journal[:0] = events
+
+
+def append_events(journal_file: Path, events: List[Dict]) -> None:
+    """Append events to a JSON Lines journal in one O(1) write."""
+    payload = b"".join(orjson.dumps(event) + b"\n" for event in events)
+    
+    # O_APPEND makes the single write an atomic append
+    fd = os.open(journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, payload)
+    finally:
+        os.close(fd)
+
+
+# Parses and dumps snapshots straight from/to JSON bytes in pydantic-core
+_STATE_ADAPTER = TypeAdapter(AgentState)
 
 
 class StateManager:
-    """Manages agent state persistence."""
+    """Manages agent state persistence.
+    
+    The state is stored as a JSON snapshot plus an append-only JSON Lines
+    journal next to it. Saving appends only the new events; the snapshot is
+    rewritten (compacted) once the journal grows too large.
+    """
+    
+    # Compact once the journal exceeds this size or this multiple of the snapshot
+    COMPACT_BYTES = 1024 * 1024
+    COMPACT_RATIO = 10
     
     def __init__(self, state_file: Path):
         self.state_file = state_file
+        self.journal_file = state_file.with_suffix(".jsonl")
         self._state: Optional[AgentState] = None
     
     def load_state(self) -> AgentState:
@@ -122,41 +212,71 @@ class StateManager:
         
         if self.state_file.exists():
             try:
-                with open(self.state_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Convert datetime strings back to datetime objects
-                if 'created' in data:
-                    data['created'] = datetime.fromisoformat(data['created'])
-                if 'last_updated' in data:
-                    data['last_updated'] = datetime.fromisoformat(data['last_updated'])
-                
-                for todo_data in data.get('todos', []):
-                    if 'created' in todo_data:
-                        todo_data['created'] = datetime.fromisoformat(todo_data['created'])
-                    if 'completed' in todo_data and todo_data['completed']:
-                        todo_data['completed'] = datetime.fromisoformat(todo_data['completed'])
-                
-                self._state = AgentState(**data)
-                console.print(f"[dim]Loaded state with {len(self._state.todos)} TODO items[/dim]")
+                self._state = _STATE_ADAPTER.validate_json(self.state_file.read_bytes())
                 
             except Exception as e:
                 console.print(f"[yellow]Warning: Failed to load state file: {e}[/yellow]")
                 console.print("[yellow]Creating new state[/yellow]")
-                self._state = AgentState(
-                    created=datetime.now(),
-                    last_updated=datetime.now()
-                )
+                now = datetime.now()
+                self._state = AgentState(created=now, last_updated=now)
         else:
-            self._state = AgentState(
-                created=datetime.now(),
-                last_updated=datetime.now()
-            )
+            now = datetime.now()
+            self._state = AgentState(created=now, last_updated=now)
+        
+        self._replay_journal()
+        if self._state.todos:
+            console.print(f"[dim]Loaded state with {len(self._state.todos)} TODO items[/dim]")
         
         return self._state
     
+    def _replay_journal(self) -> None:
+        """Apply journal events recorded after the last snapshot."""
+        try:
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        self._state.apply_event(orjson.loads(line))
+                    except (orjson.JSONDecodeError, KeyError, ValueError):
+                        continue  # Skip a torn trailing line from an interrupted write
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            console.print(f"[yellow]Warning: Failed to replay state journal: {e}[/yellow]")
+    
     def save_state(self) -> bool:
-        """Save current state to file."""
+        """Persist pending changes by appending them to the journal."""
+        if not self._state:
+            return True  # Nothing to save
+        
+        events = self._state.pop_journal()
+        if not events or not self.state_file.exists():
+            # Changes made outside the journaled operations need a full snapshot
+            return self.compact()
+        
+        try:
+            append_events(self.journal_file, events)
+        except Exception as e:
+            # Keep the events queued so the next save can retry them
+            self._state.requeue_journal(events)
+            console.print(f"[red]Error saving state: {e}[/red]")
+            return False
+        
+        if self._needs_compaction():
+            return self.compact()
+        
+        return True
+    
+    def _needs_compaction(self) -> bool:
+        """Check whether the journal has outgrown the snapshot."""
+        try:
+            journal_size = self.journal_file.stat().st_size
+            snapshot_size = self.state_file.stat().st_size
+        except FileNotFoundError:
+            return False
+        return journal_size > self.COMPACT_BYTES or journal_size > self.COMPACT_RATIO * snapshot_size
+    
+    def compact(self) -> bool:
+        """Rewrite the full state snapshot and truncate the journal."""
         if not self._state:
             return True  # Nothing to save
         
@@ -164,22 +284,12 @@ class StateManager:
             # Ensure parent directory exists
             self.state_file.parent.mkdir(parents=True, exist_ok=True)
             
-            # Convert to dict with ISO format dates
-            data = self._state.model_dump()
+            # Swap in a complete file, so a crash never leaves a torn snapshot
+            atomic_write(self.state_file, _STATE_ADAPTER.dump_json(self._state, indent=2))
             
-            # Convert datetime objects to ISO strings
-            data['created'] = self._state.created.isoformat()
-            data['last_updated'] = self._state.last_updated.isoformat()
-            
-            for todo_data in data['todos']:
-                if isinstance(todo_data['created'], datetime):
-                    todo_data['created'] = todo_data['created'].isoformat()
-                if todo_data.get('completed') and isinstance(todo_data['completed'], datetime):
-                    todo_data['completed'] = todo_data['completed'].isoformat()
-            
-            # Write to file
-            with open(self.state_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            # The snapshot now contains every journaled event
+            self._state.pop_journal()
+            self.journal_file.unlink(missing_ok=True)
             
             return True
             
@@ -192,6 +302,15 @@ class StateManager:
         return self.load_state()
 
 
+# Rich labels for the TODO table, built once rather than per row
+STATUS_LABELS = {
+    "pending": "[yellow]Pending[/yellow]",
+    "in_progress": "[blue]In Progress[/blue]",
+    "completed": "[green]Completed[/green]",
+    "cancelled": "[red]Cancelled[/red]"
+}
+
+
 def display_todos(todos: List[TodoItem], title: str = "TODO Items") -> None:
     """Display TODO items in a formatted table."""
     
@@ -207,12 +326,7 @@ def display_todos(todos: List[TodoItem], title: str = "TODO Items") -> None:
     table.add_column("Completed", style="green", width=12)
     
     for todo in todos:
-        status_color = {
-            "pending": "[yellow]Pending[/yellow]",
-            "in_progress": "[blue]In Progress[/blue]",
-            "completed": "[green]Completed[/green]",
-            "cancelled": "[red]Cancelled[/red]"
-        }.get(todo.status, todo.status)
+        status_color = STATUS_LABELS.get(todo.status, todo.status)
         
         created_str = todo.created.strftime("%m-%d %H:%M")
         completed_str = todo.completed.strftime("%m-%d %H:%M") if todo.completed else ""
@@ -234,34 +348,39 @@ def generate_todo_markdown(todos: List[TodoItem]) -> str:
     if not todos:
         return "No TODO items.\n"
     
-    content = "# TODO List\n\n"
+    lines = ["# TODO List", ""]
     
-    # Group by status
+    # Group by status in a single pass
     statuses = ["pending", "in_progress", "completed", "cancelled"]
+    buckets: Dict[str, List[TodoItem]] = {status: [] for status in statuses}
+    for todo in todos:
+        bucket = buckets.get(todo.status)
+        if bucket is not None:
+            bucket.append(todo)
     
     for status in statuses:
-        status_todos = [todo for todo in todos if todo.status == status]
+        status_todos = buckets[status]
         if not status_todos:
             continue
         
-        status_title = status.replace("_", " ").title()
-        content += f"## {status_title}\n\n"
+        lines.append(f"## {status.replace('_', ' ').title()}")
+        lines.append("")
         
+        checkbox = "- [x]" if status == "completed" else "- [ ]"
         for todo in status_todos:
-            checkbox = "- [x]" if todo.status == "completed" else "- [ ]"
-            content += f"{checkbox} **#{todo.id}** {todo.title}\n"
+            lines.append(f"{checkbox} **#{todo.id}** {todo.title}")
             
             if todo.description:
-                content += f"  - {todo.description}\n"
+                lines.append(f"  - {todo.description}")
             
-            content += f"  - Created: {todo.created.strftime('%Y-%m-%d %H:%M')}\n"
+            lines.append(f"  - Created: {todo.created.strftime('%Y-%m-%d %H:%M')}")
             
             if todo.completed:
-                content += f"  - Completed: {todo.completed.strftime('%Y-%m-%d %H:%M')}\n"
+                lines.append(f"  - Completed: {todo.completed.strftime('%Y-%m-%d %H:%M')}")
             
-            content += "\n"
+            lines.append("")
     
-    return content
+    return "\n".join(lines) + "\n"
 
 
 def create_state_manager(state_file: Path) -> StateManager:
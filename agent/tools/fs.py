@@ -1,84 +1,164 @@
 """File system operations for the Local Coding Agent."""
 
+import mmap
 import os
 import shutil
+import stat
+import tempfile
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional, Union
 
 import typer
 from rich.console import Console
 from rich.prompt import Confirm
 
+from .output import emit as _emit
+
 console = Console()
 
+# Files larger than this are decoded straight from a memory map
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def resolve_within(path: Union[str, Path], base_dir: Union[str, Path]) -> Optional[str]:
+    """Resolve a path, returning None if it falls outside base_dir.
+    
+    ``base_dir`` must already be resolved, e.g. ``config.workdir_resolved``.
+    """
+    base = os.fspath(base_dir)
+    resolved = os.path.realpath(path)
+    try:
+        return resolved if os.path.commonpath([base, resolved]) == base else None
+    except ValueError:
+        return None  # Different drives on Windows
+
+
+def resolve_workdir_path(path: Union[str, Path], workdir: Path) -> Path:
+    """Resolve a user-supplied path against the working directory (absolute paths are kept)."""
+    return workdir / path
+
+
+def _default_file_mode() -> int:
+    """Permissions a newly created file would get under the current umask."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def atomic_write(path: Union[str, Path], data: bytes, mode: Optional[int] = None) -> None:
+    """Write a file via a unique sibling temp file and os.replace, so readers never see a torn file.
+    
+    Symlinks are followed, so the link's target is replaced rather than the link
+    itself. Pass ``mode`` to set the permissions explicitly; otherwise those of
+    the existing file (or the umask default for a new one) are kept.
+    """
+    target_path = os.path.realpath(path)
+    if mode is None:
+        try:
+            mode = os.stat(target_path).st_mode
+        except FileNotFoundError:
+            mode = _default_file_mode()
+    
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(target_path),
+        prefix=f".{os.path.basename(target_path)}.",
+        suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, stat.S_IMODE(mode))
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 
 def safe_delete(path: str, yes: bool = False) -> bool:
     """Safely delete a file or directory with confirmation."""
     target_path = Path(path)
     
-    if not target_path.exists():
-        console.print(f"[red]Error:[/red] Path '{path}' does not exist")
+    # One stat() call answers both the existence and the file-type checks
+    try:
+        is_file = stat.S_ISREG(os.stat(target_path).st_mode)
+    except OSError:
+        _emit(f"[red]Error:[/red] Path '{path}' does not exist")
         return False
     
     # Show what will be deleted
-    if target_path.is_file():
-        console.print(f"[yellow]File to delete:[/yellow] {target_path.absolute()}")
+    if is_file:
+        _emit(f"[yellow]File to delete:[/yellow] {target_path.absolute()}")
     else:
-        console.print(f"[yellow]Directory to delete:[/yellow] {target_path.absolute()}")
+        _emit(f"[yellow]Directory to delete:[/yellow] {target_path.absolute()}")
         # Show directory contents
         try:
-            contents = list(target_path.iterdir())
-            if contents:
-                console.print(f"[yellow]Contains {len(contents)} items[/yellow]")
+            with os.scandir(target_path) as entries:
+                item_count = sum(1 for _ in entries)
+            if item_count:
+                _emit(f"[yellow]Contains {item_count} items[/yellow]")
         except PermissionError:
-            console.print("[red]Permission denied to read directory contents[/red]")
+            _emit("[red]Permission denied to read directory contents[/red]")
     
     # Confirm deletion unless --yes flag is used
     if not yes:
         if not Confirm.ask(f"Are you sure you want to delete '{path}'?"):
-            console.print("[blue]Deletion cancelled[/blue]")
+            _emit("[blue]Deletion cancelled[/blue]")
             return False
     
     try:
-        if target_path.is_file():
+        if is_file:
             target_path.unlink()
-            console.print(f"[green]File deleted:[/green] {path}")
+            _emit(f"[green]File deleted:[/green] {path}")
         else:
             shutil.rmtree(target_path)
-            console.print(f"[green]Directory deleted:[/green] {path}")
+            _emit(f"[green]Directory deleted:[/green] {path}")
         return True
     except PermissionError:
-        console.print(f"[red]Permission denied:[/red] Cannot delete '{path}'")
+        _emit(f"[red]Permission denied:[/red] Cannot delete '{path}'")
         return False
     except Exception as e:
-        console.print(f"[red]Error deleting '{path}':[/red] {e}")
+        _emit(f"[red]Error deleting '{path}':[/red] {e}")
         return False
 
 
-def safe_write(file_path: str, content: str, overwrite: bool = False) -> bool:
-    """Safely write content to a file with confirmation for overwrite."""
+def safe_write(file_path: str, content: str, overwrite: bool = False, durable: bool = False) -> bool:
+    """Safely write content to a file with confirmation for overwrite.
+    
+    With ``durable`` the data is fsynced before returning.
+    """
     target_path = Path(file_path)
     
     # Check if file exists and handle overwrite
     if target_path.exists() and not overwrite:
-        console.print(f"[yellow]File exists:[/yellow] {file_path}")
+        _emit(f"[yellow]File exists:[/yellow] {file_path}")
         if not Confirm.ask("Overwrite existing file?"):
-            console.print("[blue]Write cancelled[/blue]")
+            _emit("[blue]Write cancelled[/blue]")
             return False
     
     try:
         # Ensure parent directory exists
         target_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # Write the file
-        target_path.write_text(content, encoding='utf-8')
-        console.print(f"[green]File written:[/green] {file_path}")
+        # Write the file as one pre-encoded buffer on a raw descriptor; 0o666 lets the umask decide, like open()
+        data = memoryview(content.encode('utf-8'))
+        fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+            if durable:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        _emit(f"[green]File written:[/green] {file_path}")
         return True
     except PermissionError:
-        console.print(f"[red]Permission denied:[/red] Cannot write to '{file_path}'")
+        _emit(f"[red]Permission denied:[/red] Cannot write to '{file_path}'")
         return False
     except Exception as e:
-        console.print(f"[red]Error writing file:[/red] {e}")
+        _emit(f"[red]Error writing file:[/red] {e}")
         return False
 
 
@@ -86,25 +166,36 @@ def read_file_safe(file_path: str) -> Optional[str]:
     """Safely read a file and return its contents."""
     target_path = Path(file_path)
     
-    if not target_path.exists():
-        console.print(f"[red]Error:[/red] File '{file_path}' does not exist")
+    try:
+        st = os.stat(target_path)
+    except OSError:
+        _emit(f"[red]Error:[/red] File '{file_path}' does not exist")
         return None
     
-    if not target_path.is_file():
-        console.print(f"[red]Error:[/red] '{file_path}' is not a file")
+    if not stat.S_ISREG(st.st_mode):
+        _emit(f"[red]Error:[/red] '{file_path}' is not a file")
         return None
     
     try:
+        if st.st_size > MMAP_THRESHOLD:
+            # Decode from the mapped pages, skipping the intermediate bytes copy
+            with open(target_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                content = str(mm, 'utf-8')
+            if '\r' in content:
+                # Match read_text()'s universal newline translation
+                content = content.replace('\r\n', '\n').replace('\r', '\n')
+            return content
+        
         content = target_path.read_text(encoding='utf-8')
         return content
     except PermissionError:
-        console.print(f"[red]Permission denied:[/red] Cannot read '{file_path}'")
+        _emit(f"[red]Permission denied:[/red] Cannot read '{file_path}'")
         return None
     except UnicodeDecodeError:
-        console.print(f"[red]Error:[/red] Cannot decode '{file_path}' as UTF-8")
+        _emit(f"[red]Error:[/red] Cannot decode '{file_path}' as UTF-8")
         return None
     except Exception as e:
-        console.print(f"[red]Error reading file:[/red] {e}")
+        _emit(f"[red]Error reading file:[/red] {e}")
         return None
 
 
@@ -112,27 +203,44 @@ def get_file_info(file_path: str) -> dict:
     """Get information about a file or directory."""
     target_path = Path(file_path)
     
-    if not target_path.exists():
+    try:
+        st = os.stat(target_path)
+    except OSError:
         return {"exists": False}
     
-    info = {
+    return {
         "exists": True,
         "path": str(target_path.absolute()),
-        "is_file": target_path.is_file(),
-        "is_dir": target_path.is_dir(),
+        "is_file": stat.S_ISREG(st.st_mode),
+        "is_dir": stat.S_ISDIR(st.st_mode),
+        "size": st.st_size,
+        "modified": st.st_mtime,
+        "permissions": oct(st.st_mode)[-3:],
     }
-    
-    try:
-        stat = target_path.stat()
-        info.update({
-            "size": stat.st_size,
-            "modified": stat.st_mtime,
-            "permissions": oct(stat.st_mode)[-3:],
-        })
-    except Exception as e:
-        info["error"] = str(e)
-    
-    return info
+
+
+def iter_directory(dir_path: Union[str, Path], show_hidden: bool = False) -> Iterator[dict]:
+    """Yield directory entries lazily, using the type and stat data cached by os.scandir."""
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if not show_hidden and entry.name.startswith('.'):
+                continue
+            
+            is_file = entry.is_file()
+            info = {
+                "name": entry.name,
+                "path": entry.path,
+                "is_file": is_file,
+                "is_dir": entry.is_dir(),
+            }
+            
+            if is_file:
+                try:
+                    info["size"] = entry.stat().st_size
+                except OSError:
+                    info["size"] = 0
+            
+            yield info
 
 
 def list_directory(dir_path: str, show_hidden: bool = False) -> list:
@@ -140,39 +248,20 @@ def list_directory(dir_path: str, show_hidden: bool = False) -> list:
     target_path = Path(dir_path)
     
     if not target_path.exists():
-        console.print(f"[red]Error:[/red] Directory '{dir_path}' does not exist")
+        _emit(f"[red]Error:[/red] Directory '{dir_path}' does not exist")
         return []
     
     if not target_path.is_dir():
-        console.print(f"[red]Error:[/red] '{dir_path}' is not a directory")
+        _emit(f"[red]Error:[/red] '{dir_path}' is not a directory")
         return []
     
     try:
-        contents = []
-        for item in target_path.iterdir():
-            if not show_hidden and item.name.startswith('.'):
-                continue
-            
-            info = {
-                "name": item.name,
-                "path": str(item),
-                "is_file": item.is_file(),
-                "is_dir": item.is_dir(),
-            }
-            
-            if item.is_file():
-                try:
-                    info["size"] = item.stat().st_size
-                except:
-                    info["size"] = 0
-            
-            contents.append(info)
-        
+        contents = list(iter_directory(target_path, show_hidden))
         return sorted(contents, key=lambda x: (not x["is_dir"], x["name"].lower()))
     
     except PermissionError:
-        console.print(f"[red]Permission denied:[/red] Cannot read directory '{dir_path}'")
+        _emit(f"[red]Permission denied:[/red] Cannot read directory '{dir_path}'")
         return []
     except Exception as e:
-        console.print(f"[red]Error reading directory:[/red] {e}")
+        _emit(f"[red]Error reading directory:[/red] {e}")
         return []
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""Console output helpers for the Local Coding Agent tools."""
+
+import re
+import sys
+
+from rich.console import Console
+
+console = Console()
+
+# Rich style tags used in the tools' messages
+_MARKUP_RE = re.compile(r"\[/?(?:red|green|yellow|blue|dim)\]")
+
+
+def strip_markup(message: str) -> str:
+    """Remove Rich style tags from a message."""
+    return _MARKUP_RE.sub("", message)
+
+
+def _write_plain(text: str) -> None:
+    """Write text to stdout as-is."""
+    sys.stdout.write(text + "\n")
+
+
+def _print_plain(message: str) -> None:
+    """Write a message without Rich markup parsing, for non-interactive output."""
+    _write_plain(strip_markup(message))
+
+
+# Piped or CI output gets no styling anyway, so skip Rich's markup and layout work there.
+# emit() takes styled messages; emit_text() takes raw text such as command output.
+emit = console.print if console.is_terminal else _print_plain
+emit_text = console.print if console.is_terminal else _write_plain
@@ -1,10 +1,12 @@
 """Patch generation and application for the Local Coding Agent."""
 
 import difflib
+import os
 import re
 import shutil
 import tempfile
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -13,16 +15,25 @@ from rich.panel import Panel
 from rich.prompt import Confirm
 from rich.syntax import Syntax
 
+from .fs import atomic_write, resolve_within
+
 console = Console()
 
+# Hunk header: @@ -start,count +start,count @@
+_HUNK_RE = re.compile(r'@@ -(\d+),?(\d*) \+(\d+),?(\d*) @@')
+# Characters not allowed in saved patch file names
+_SAFE_DESC_RE = re.compile(r'[^\w\-_]')
+
 
 class PatchResult:
     """Result of patch operations."""
     
-    def __init__(self, success: bool, message: str, patch_content: Optional[str] = None):
+    def __init__(self, success: bool, message: str, patch_content: Optional[str] = None,
+                 files: Optional[List[Dict]] = None):
         self.success = success
         self.message = message
         self.patch_content = patch_content
+        self.files = files  # Parsed file data, set by validate_patch for reuse when applying
         self.timestamp = datetime.now()
 
 
@@ -30,6 +41,10 @@ def generate_unified_diff(original_content: str, modified_content: str,
                          filename: str = "file") -> str:
     """Generate unified diff between two strings."""
     
+    # Identical inputs have no diff; skip difflib's matching entirely
+    if original_content == modified_content:
+        return ""
+    
     original_lines = original_content.splitlines(keepends=True)
     modified_lines = modified_content.splitlines(keepends=True)
     
@@ -49,14 +64,24 @@ def generate_file_patch(file_path: str, new_content: str) -> PatchResult:
     
     target_path = Path(file_path)
     
-    # Read current content
-    if target_path.exists():
-        try:
-            original_content = target_path.read_text(encoding='utf-8')
-        except Exception as e:
-            return PatchResult(False, f"Error reading file {file_path}: {e}")
-    else:
-        original_content = ""
+    # Read current content; a missing file diffs against empty content
+    try:
+        original_bytes = target_path.read_bytes()
+    except FileNotFoundError:
+        original_bytes = b""
+    except Exception as e:
+        return PatchResult(False, f"Error reading file {file_path}: {e}")
+    
+    # Unchanged files bail out on a bytes comparison (length first) before decoding
+    if original_bytes == new_content.encode('utf-8'):
+        return PatchResult(True, "No changes needed", "")
+    
+    try:
+        original_content = original_bytes.decode('utf-8')
+    except UnicodeDecodeError as e:
+        return PatchResult(False, f"Error reading file {file_path}: {e}")
+    if '\r' in original_content:
+        original_content = original_content.replace('\r\n', '\n').replace('\r', '\n')
     
     # Generate diff
     if original_content == new_content:
@@ -70,20 +95,44 @@ def generate_file_patch(file_path: str, new_content: str) -> PatchResult:
     return PatchResult(True, f"Patch generated for {file_path}", patch_content)
 
 
+def _parse_hunk_header(line: str) -> Optional[Tuple[int, int, int, int]]:
+    """Parse a hunk header into (old_start, old_count, new_start, new_count)."""
+    match = _HUNK_RE.match(line)
+    if not match:
+        return None
+    
+    old_start, old_count, new_start, new_count = match.groups()
+    return (int(old_start), int(old_count) if old_count else 1,
+            int(new_start), int(new_count) if new_count else 1)
+
+
 def parse_unified_diff(patch_content: str) -> List[Dict]:
-    """Parse unified diff format into structured data."""
+    """Parse unified diff format into structured data.
+    
+    Results are cached by content, so validating and then applying the same
+    patch parses it once. The returned file dicts are shared; treat them as
+    read-only.
+    """
+    return list(_parse_unified_diff_cached(patch_content))
+
+
+@lru_cache(maxsize=32)
+def _parse_unified_diff_cached(patch_content: str) -> Tuple[Dict, ...]:
+    """Parse a unified diff (uncached implementation)."""
     
     files = []
     current_file = None
     
     lines = patch_content.split('\n')
+    line_count = len(lines)
     i = 0
     
-    while i < len(lines):
+    while i < line_count:
         line = lines[i]
+        prefix = line[:2]  # One slice decides which (if any) header this line can be
         
         # File header
-        if line.startswith('--- '):
+        if prefix == '--' and line.startswith('--- '):
             if current_file:
                 files.append(current_file)
             
@@ -93,18 +142,14 @@ def parse_unified_diff(patch_content: str) -> List[Dict]:
                 'hunks': []
             }
         
-        elif line.startswith('+++ ') and current_file:
+        elif prefix == '++' and current_file and line.startswith('+++ '):
             current_file['modified_file'] = line[4:].strip()
         
         # Hunk header
-        elif line.startswith('@@') and current_file:
-            # Parse hunk header: @@ -start,count +start,count @@
-            match = re.match(r'@@ -(\d+),?(\d*) \+(\d+),?(\d*) @@', line)
-            if match:
-                old_start = int(match.group(1))
-                old_count = int(match.group(2)) if match.group(2) else 1
-                new_start = int(match.group(3))
-                new_count = int(match.group(4)) if match.group(4) else 1
+        elif prefix == '@@' and current_file:
+            header = _parse_hunk_header(line)
+            if header:
+                old_start, old_count, new_start, new_count = header
                 
                 hunk = {
                     'old_start': old_start,
@@ -115,11 +160,19 @@ def parse_unified_diff(patch_content: str) -> List[Dict]:
                 }
                 
                 # Read hunk content
+                hunk_append = hunk['lines'].append
                 i += 1
-                while i < len(lines) and not lines[i].startswith('@@') and not lines[i].startswith('---'):
+                while i < line_count:
                     hunk_line = lines[i]
-                    if hunk_line.startswith(' ') or hunk_line.startswith('+') or hunk_line.startswith('-'):
-                        hunk['lines'].append(hunk_line)
+                    first = hunk_line[:1]
+                    if first == ' ' or first == '+':
+                        hunk_append(hunk_line)
+                    elif first == '-':
+                        if hunk_line.startswith('---'):
+                            break  # Next file header
+                        hunk_append(hunk_line)
+                    elif first == '@' and hunk_line.startswith('@@'):
+                        break  # Next hunk header
                     i += 1
                 
                 current_file['hunks'].append(hunk)
@@ -130,7 +183,7 @@ def parse_unified_diff(patch_content: str) -> List[Dict]:
     if current_file:
         files.append(current_file)
     
-    return files
+    return tuple(files)
 
 
 def apply_patch_to_file(file_path: str, patch_data: Dict) -> PatchResult:
@@ -138,43 +191,40 @@ def apply_patch_to_file(file_path: str, patch_data: Dict) -> PatchResult:
     
     target_path = Path(file_path)
     
-    # Read current content
-    if target_path.exists():
-        try:
-            lines = target_path.read_text(encoding='utf-8').splitlines()
-        except Exception as e:
-            return PatchResult(False, f"Error reading file {file_path}: {e}")
-    else:
-        lines = []
+    # Work on raw bytes lines; only the hunk lines need encoding
+    mode = None
+    lines = []
+    try:
+        with open(target_path, 'rb') as f:
+            mode = os.fstat(f.fileno()).st_mode
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        pass  # New file
+    except Exception as e:
+        return PatchResult(False, f"Error reading file {file_path}: {e}")
     
-    # Apply hunks in reverse order to maintain line numbers
-    for hunk in reversed(patch_data['hunks']):
+    # Build the output in one forward pass over hunks sorted by position
+    output = []
+    cursor = 0
+    for hunk in sorted(patch_data['hunks'], key=lambda h: h['old_start']):
         try:
-            # Apply hunk
-            old_start = hunk['old_start'] - 1  # Convert to 0-based indexing
-            
-            # Remove old lines and add new ones
-            new_lines = []
-            hunk_lines = hunk['lines']
+            old_start = max(hunk['old_start'] - 1, 0)  # Convert to 0-based indexing
+            if old_start < cursor:
+                return PatchResult(False, f"Overlapping hunk at line {hunk['old_start']}")
             
-            for hunk_line in hunk_lines:
-                if hunk_line.startswith('+'):
-                    new_lines.append(hunk_line[1:])  # Add line (remove +)
-                elif hunk_line.startswith(' '):
-                    new_lines.append(hunk_line[1:])  # Context line (remove space)
-                # Skip lines starting with '-' (deleted lines)
-            
-            # Replace the section
-            end_line = old_start + hunk['old_count']
-            lines[old_start:end_line] = new_lines
+            # Copy unchanged lines, then the added and context lines without their marker
+            output.extend(lines[cursor:old_start])
+            output.extend(hunk_line[1:].encode('utf-8') for hunk_line in hunk['lines'] if hunk_line[:1] in ('+', ' '))
+            cursor = old_start + hunk['old_count']
             
         except Exception as e:
             return PatchResult(False, f"Error applying hunk: {e}")
+    output.extend(lines[cursor:])
     
     # Write modified content
     try:
         target_path.parent.mkdir(parents=True, exist_ok=True)
-        target_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        atomic_write(target_path, b'\n'.join(output) + b'\n', mode)
         return PatchResult(True, f"Patch applied successfully to {file_path}")
     except Exception as e:
         return PatchResult(False, f"Error writing file {file_path}: {e}")
@@ -201,13 +251,13 @@ def save_patch(patch_content: str, patch_dir: Path, description: str = "patch")
     
     # Generate filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_desc = re.sub(r'[^\w\-_]', '_', description.lower())[:20]
+    safe_desc = _SAFE_DESC_RE.sub('_', description.lower())[:20]
     filename = f"{safe_desc}-{timestamp}.patch"
     
     patch_file = patch_dir / filename
     
     try:
-        patch_file.write_text(patch_content, encoding='utf-8')
+        patch_file.write_bytes(patch_content.encode('utf-8'))
         console.print(f"[green]Patch saved to:[/green] {patch_file}")
         return patch_file
     except Exception as e:
@@ -215,19 +265,24 @@ def save_patch(patch_content: str, patch_dir: Path, description: str = "patch")
         raise
 
 
-def apply_patch_file(patch_file: Path, base_dir: Path, dry_run: bool = False) -> List[PatchResult]:
-    """Apply a patch file to the specified base directory."""
-    
-    if not patch_file.exists():
-        return [PatchResult(False, f"Patch file not found: {patch_file}")]
+def apply_patch_file(patch_file: Path, base_dir: Path, dry_run: bool = False,
+                     files_data: Optional[List[Dict]] = None) -> List[PatchResult]:
+    """Apply a patch file to the specified base directory.
     
-    try:
-        patch_content = patch_file.read_text(encoding='utf-8')
-    except Exception as e:
-        return [PatchResult(False, f"Error reading patch file: {e}")]
+    ``base_dir`` must already be resolved (e.g. ``config.workdir_resolved``). Pass ``files_data`` (e.g. ``validate_patch(...).files``) to skip re-reading
+    and re-parsing a patch that was just validated.
+    """
     
-    # Parse patch
-    files_data = parse_unified_diff(patch_content)
+    if files_data is None:
+        try:
+            patch_content = patch_file.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return [PatchResult(False, f"Patch file not found: {patch_file}")]
+        except Exception as e:
+            return [PatchResult(False, f"Error reading patch file: {e}")]
+        
+        # Parse patch
+        files_data = parse_unified_diff(patch_content)
     
     if not files_data:
         return [PatchResult(False, "No valid patch data found")]
@@ -242,13 +297,13 @@ def apply_patch_file(patch_file: Path, base_dir: Path, dry_run: bool = False) ->
         
         full_path = base_dir / file_path
         
-        # Validate path is within base_dir
+        # Validate path is within base_dir, resolving it only once
         try:
-            full_path = full_path.resolve()
-            base_dir_resolved = base_dir.resolve()
-            if not str(full_path).startswith(str(base_dir_resolved)):
+            resolved_path = resolve_within(full_path, base_dir)
+            if resolved_path is None:
                 results.append(PatchResult(False, f"Path outside base directory: {file_path}"))
                 continue
+            full_path = Path(resolved_path)
         except Exception as e:
             results.append(PatchResult(False, f"Invalid path: {file_path}"))
             continue
@@ -278,19 +333,21 @@ def validate_patch(patch_content: str) -> PatchResult:
             if not file_data.get('hunks'):
                 return PatchResult(False, f"No hunks found for file: {file_data.get('modified_file', 'unknown')}")
         
-        return PatchResult(True, f"Valid patch with {len(files_data)} file(s)")
+        return PatchResult(True, f"Valid patch with {len(files_data)} file(s)", files=files_data)
         
     except Exception as e:
         return PatchResult(False, f"Invalid patch format: {e}")
 
 
-def create_backup(file_path: str, backup_dir: Path) -> Optional[Path]:
-    """Create a backup of a file before applying patch."""
+def create_backup(file_path: str, backup_dir: Path, hardlink: bool = False) -> Optional[Path]:
+    """Create a backup of a file before applying patch.
     
-    source_path = Path(file_path)
+    With ``hardlink`` the backup shares the original's inode instead of copying
+    its data. That is only a faithful snapshot when the file is then replaced
+    (as ``apply_patch_to_file`` does), not rewritten in place.
+    """
     
-    if not source_path.exists():
-        return None
+    source_path = Path(file_path)
     
     try:
         backup_dir.mkdir(parents=True, exist_ok=True)
@@ -300,12 +357,20 @@ def create_backup(file_path: str, backup_dir: Path) -> Optional[Path]:
         backup_name = f"{source_path.name}.backup.{timestamp}"
         backup_path = backup_dir / backup_name
         
-        # Copy file
-        shutil.copy2(source_path, backup_path)
+        # Link or copy file
+        if hardlink:
+            try:
+                os.link(source_path, backup_path)
+            except OSError:
+                shutil.copy2(source_path, backup_path)  # Different filesystem or no link support
+        else:
+            shutil.copy2(source_path, backup_path)
         
         console.print(f"[dim]Backup created: {backup_path}[/dim]")
         return backup_path
         
+    except FileNotFoundError:
+        return None  # Nothing to back up
     except Exception as e:
         console.print(f"[yellow]Warning: Failed to create backup: {e}[/yellow]")
         return None
\ No newline at end of file
@@ -1,22 +1,82 @@
 """Shell command execution for the Local Coding Agent."""
 
+import atexit
+import heapq
 import json
 import os
+import re
 import shlex
 import subprocess
 import time
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+import orjson
 from rich.console import Console
 
+from .output import emit, emit_text
+
 console = Console()
 
+# Shell constructs rejected by is_safe_command, each matched in a single scan
+_SUBSTITUTION_RE = re.compile(r'\$\(|`|\$\{')
+_DEVICE_REDIRECT_RE = re.compile(r'>>? /dev/')
+
+# Whitelist of commands is_safe_command allows, including after pipes
+ALLOWED_COMMANDS = frozenset({
+    'ls', 'cat', 'grep', 'find', 'echo', 'pwd', 'head', 'tail',
+    'git', 'npm', 'pip', 'python', 'python3', 'node', 'make', 'cmake',
+    'which', 'whoami', 'id', 'date', 'curl', 'wget', 'tree', 'less',
+    'more', 'wc', 'sort', 'uniq', 'awk', 'sed', 'diff', 'patch',
+    'tar', 'gzip', 'gunzip', 'zip', 'unzip', 'touch', 'mkdir', 'rm',
+    'cp', 'mv', 'ln', 'chmod', 'chown', 'file', 'stat', 'du', 'df'
+})
+
+# Absolute path prefixes command arguments may not start with
+CRITICAL_PATHS = ('/', '/dev', '/sys', '/proc', '/etc', '/usr', '/var')
+
+# Raw O_APPEND descriptor for the current day's command log, reused across commands
+_log_fd: Optional[int] = None
+_log_fd_path: Optional[Path] = None
+
+
+@lru_cache(maxsize=8)
+def _log_day(day: date) -> str:
+    """Format the daily log file stamp, once per calendar day."""
+    return day.strftime("%Y%m%d")
+
+
+def _close_log_fd() -> None:
+    """Close the cached command log descriptor."""
+    global _log_fd, _log_fd_path
+    if _log_fd is not None:
+        os.close(_log_fd)
+        _log_fd = None
+        _log_fd_path = None
+
+
+atexit.register(_close_log_fd)
+
+
+def _get_log_fd(log_file: Path) -> int:
+    """Get an append descriptor for log_file, reopening only when the file changes."""
+    global _log_fd, _log_fd_path
+    if _log_fd is None or _log_fd_path != log_file:
+        _close_log_fd()
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        _log_fd = os.open(log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        _log_fd_path = log_file
+    return _log_fd
+
 
 class ShellResult:
     """Result of a shell command execution."""
     
+    __slots__ = ("command", "returncode", "stdout", "stderr", "execution_time",
+                 "working_dir", "timestamp", "_output")
+    
     def __init__(self, command: str, returncode: int, stdout: str, stderr: str, 
                  execution_time: float, working_dir: str):
         self.command = command
@@ -26,6 +86,7 @@ class ShellResult:
         self.execution_time = execution_time
         self.working_dir = working_dir
         self.timestamp = datetime.now()
+        self._output: Optional[str] = None
     
     @property
     def success(self) -> bool:
@@ -35,42 +96,42 @@ class ShellResult:
     @property
     def output(self) -> str:
         """Get combined output."""
-        result = self.stdout
-        if self.stderr:
-            if result:
-                result += "\n" + self.stderr
-            else:
-                result = self.stderr
-        return result
+        if self._output is None:
+            self._output = "\n".join(part for part in (self.stdout, self.stderr) if part)
+        return self._output
 
 
 def execute_command(
     command: str,
     working_dir: Optional[str] = None,
     timeout: Optional[float] = None,
-    capture_output: bool = True
+    capture_output: bool = True,
+    close_fds: bool = True
 ) -> ShellResult:
-    """Execute a shell command safely."""
+    """Execute a shell command safely.
+    
+    ``close_fds=False`` skips closing inherited descriptors in the child, which
+    is much cheaper when the file descriptor limit is high.
+    """
     
     if working_dir is None:
         working_dir = os.getcwd()
     
-    working_path = Path(working_dir)
-    if not working_path.is_dir():
-        console.print(f"[red]Error:[/red] Working directory '{working_dir}' does not exist")
+    if not os.path.isdir(working_dir):
+        emit(f"[red]Error:[/red] Working directory '{working_dir}' does not exist")
         return ShellResult(command, -1, "", f"Working directory is not a directory or does not exist: {working_dir}", 0.0, working_dir)
     
     # Parse command safely
     try:
         cmd_args = shlex.split(command)
     except ValueError as e:
-        console.print(f"[red]Error:[/red] Invalid command syntax: {e}")
+        emit(f"[red]Error:[/red] Invalid command syntax: {e}")
         return ShellResult(command, -1, "", str(e), 0.0, working_dir)
     
     # Safety gate
     ok, reason = is_safe_command(command)
     if not ok:
-        console.print(f"[red]Blocked by safety policy:[/red] {reason}")
+        emit(f"[red]Blocked by safety policy:[/red] {reason}")
         return ShellResult(
             command,
             -1,
@@ -80,10 +141,10 @@ def execute_command(
             working_dir
         )
     
-    console.print(f"[blue]Executing:[/blue] {command}")
-    console.print(f"[dim]Working directory:[/dim] {working_path.absolute()}")
+    emit(f"[blue]Executing:[/blue] {command}")
+    emit(f"[dim]Working directory:[/dim] {os.path.abspath(working_dir)}")
     
-    start_time = time.time()
+    start_ns = time.monotonic_ns()
     
     try:
         # Execute command
@@ -94,7 +155,8 @@ def execute_command(
                 cwd=working_dir,
                 capture_output=True,
                 text=True,
-                timeout=timeout
+                timeout=timeout,
+                close_fds=close_fds
             )
             stdout = result.stdout
             stderr = result.stderr
@@ -105,52 +167,51 @@ def execute_command(
                 cmd_args,
                 shell=False,
                 cwd=working_dir,
-                timeout=timeout
+                timeout=timeout,
+                close_fds=close_fds
             )
             stdout = ""
             stderr = ""
             returncode = result.returncode
         
-        execution_time = time.time() - start_time
+        execution_time = (time.monotonic_ns() - start_ns) / 1e9
         
         # Create result object
         shell_result = ShellResult(command, returncode, stdout, stderr, execution_time, working_dir)
         
         # Display results
         if shell_result.success:
-            console.print(f"[green]Command completed successfully[/green] (took {execution_time:.2f}s)")
+            emit(f"[green]Command completed successfully[/green] (took {execution_time:.2f}s)")
             if stdout and capture_output:
-                console.print("[dim]Output:[/dim]")
-                console.print(stdout)
+                emit("[dim]Output:[/dim]")
+                emit_text(stdout)
         else:
-            console.print(f"[red]Command failed[/red] with exit code {returncode}")
+            emit(f"[red]Command failed[/red] with exit code {returncode}")
             if stderr and capture_output:
-                console.print("[dim]Error output:[/dim]")
-                console.print(stderr)
+                emit("[dim]Error output:[/dim]")
+                emit_text(stderr)
             if stdout and capture_output:
-                console.print("[dim]Standard output:[/dim]")
-                console.print(stdout)
+                emit("[dim]Standard output:[/dim]")
+                emit_text(stdout)
         
         return shell_result
         
     except subprocess.TimeoutExpired:
-        execution_time = time.time() - start_time
-        console.print(f"[red]Command timed out[/red] after {execution_time:.2f}s")
+        execution_time = (time.monotonic_ns() - start_ns) / 1e9
+        emit(f"[red]Command timed out[/red] after {execution_time:.2f}s")
         return ShellResult(command, -1, "", f"Command timed out after {execution_time:.2f}s", execution_time, working_dir)
     
     except Exception as e:
-        execution_time = time.time() - start_time
-        console.print(f"[red]Error executing command:[/red] {e}")
+        execution_time = (time.monotonic_ns() - start_ns) / 1e9
+        emit(f"[red]Error executing command:[/red] {e}")
         return ShellResult(command, -1, "", str(e), execution_time, working_dir)
 
 
 def log_command(result: ShellResult, log_dir: Path) -> None:
     """Log command execution to file in JSON format."""
     try:
-        log_dir.mkdir(parents=True, exist_ok=True)
-        
         # Create log filename with daily rotation
-        day = result.timestamp.strftime("%Y%m%d")
+        day = _log_day(result.timestamp.date())
         log_file = log_dir / f"commands-{day}.jsonl"
         
         # Prepare log entry
@@ -165,45 +226,67 @@ def log_command(result: ShellResult, log_dir: Path) -> None:
             "stderr": result.stderr
         }
         
-        # Append to log file
-        with open(log_file, 'a', encoding='utf-8') as f:
-            json.dump(log_entry, f, ensure_ascii=False)
-            f.write('\n')
+        # O_APPEND makes the single unbuffered write an atomic append
+        os.write(_get_log_fd(log_file), orjson.dumps(log_entry) + b"\n")
         
-        console.print(f"[dim]Command logged to: {log_file}[/dim]")
+        emit(f"[dim]Command logged to: {log_file}[/dim]")
         
     except Exception as e:
         console.print(f"[yellow]Warning: Failed to log command: {e}[/yellow]")
 
 
+def _tail_lines(path: Path, count: int, block_size: int = 8192) -> List[bytes]:
+    """Read the last count non-empty lines of a file by scanning backwards."""
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        buffer = b""
+        lines: List[bytes] = []
+        
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            buffer = f.read(read_size) + buffer
+            
+            # Everything after the first newline is complete; keep the head for the next block
+            lines = [line for line in buffer.split(b"\n")[1:] if line.strip()]
+            if len(lines) >= count:
+                return lines[-count:]
+        
+        lines = [line for line in buffer.split(b"\n") if line.strip()]
+        return lines[-count:]
+
+
 def get_command_history(log_dir: Path, limit: int = 10) -> List[Dict]:
-    """Get recent command history from logs."""
+    """Get recent command history from logs, newest first."""
     try:
-        if not log_dir.exists():
-            return []
+        with os.scandir(log_dir) as it:
+            log_names = [entry.name for entry in it
+                         if entry.name.startswith("commands-") and entry.name.endswith(".jsonl")]
         
-        log_files = sorted(log_dir.glob("commands-*.jsonl"), reverse=True)
+        # Each daily file holds at least one entry, so at most `limit` files are needed
         history = []
         
-        for log_file in log_files:
+        for log_name in heapq.nlargest(limit, log_names):
+            log_file = log_dir / log_name
             try:
-                with open(log_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if len(history) >= limit:
-                            break
-                        try:
-                            entry = json.loads(line.strip())
-                            history.append(entry)
-                        except json.JSONDecodeError:
-                            continue  # Skip malformed entries
+                lines = _tail_lines(log_file, limit - len(history))
             except Exception:
                 continue  # Skip files that can't be read
             
+            for line in reversed(lines):
+                try:
+                    history.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # Skip malformed entries
+            
             if len(history) >= limit:
                 break
         
         return history[:limit]
         
+    except FileNotFoundError:
+        return []  # No logs yet
     except Exception as e:
         console.print(f"[yellow]Warning: Failed to get command history: {e}[/yellow]")
         return []
@@ -212,46 +295,35 @@ def get_command_history(log_dir: Path, limit: int = 10) -> List[Dict]:
 def is_safe_command(command: str) -> Tuple[bool, str]:
     """Check if a command is considered safe to execute using whitelist approach."""
     
-    # Whitelist of allowed commands
-    ALLOWED_COMMANDS = {
-        'ls', 'cat', 'grep', 'find', 'echo', 'pwd', 'head', 'tail',
-        'git', 'npm', 'pip', 'python', 'python3', 'node', 'make', 'cmake',
-        'which', 'whoami', 'id', 'date', 'curl', 'wget', 'tree', 'less',
-        'more', 'wc', 'sort', 'uniq', 'awk', 'sed', 'diff', 'patch',
-        'tar', 'gzip', 'gunzip', 'zip', 'unzip', 'touch', 'mkdir', 'rm',
-        'cp', 'mv', 'ln', 'chmod', 'chown', 'file', 'stat', 'du', 'df'
-    }
-    
     try:
-        cmd_parts = shlex.split(command)
+        # Tokenize once; '|' becomes its own token even without surrounding spaces
+        lexer = shlex.shlex(command, posix=True, punctuation_chars='|')
+        lexer.whitespace_split = True
+        lexer.commenters = ''  # Match shlex.split: '#' is not a comment in the executed argv
+        cmd_parts = list(lexer)
         if not cmd_parts:
             return False, "Empty command"
         
-        base_command = cmd_parts[0].split('/')[-1]  # Get command name
+        base_command = os.path.basename(cmd_parts[0])  # Get command name
         
         if base_command not in ALLOWED_COMMANDS:
             return False, f"Command '{base_command}' not in allowed list"
         
         # Check for command substitution
-        if '$(' in command or '`' in command or '${' in command:
+        if _SUBSTITUTION_RE.search(command):
             return False, "Command substitution not allowed"
         
         # Check for dangerous redirections
-        if any(redir in command for redir in [' > /dev/', ' >> /dev/', '> /dev/', '>> /dev/']):
+        if _DEVICE_REDIRECT_RE.search(command):
             return False, "Redirection to device files not allowed"
         
         # Check for pipe to dangerous commands
-        if '|' in command:
-            pipe_parts = command.split('|')
-            for part in pipe_parts[1:]:  # Check commands after pipes
-                part = part.strip()
-                if part:
-                    try:
-                        pipe_cmd = shlex.split(part)[0].split('/')[-1]
-                        if pipe_cmd not in ALLOWED_COMMANDS:
-                            return False, f"Piped command '{pipe_cmd}' not in allowed list"
-                    except (IndexError, ValueError):
-                        return False, "Invalid pipe syntax"
+        for index, token in enumerate(cmd_parts[:-1]):
+            if token.strip('|') or cmd_parts[index + 1].strip('|') == '':
+                continue  # Not a pipe, or no command follows it
+            pipe_cmd = os.path.basename(cmd_parts[index + 1])
+            if pipe_cmd not in ALLOWED_COMMANDS:
+                return False, f"Piped command '{pipe_cmd}' not in allowed list"
         
         # Special checks for rm command
         if base_command == 'rm':
@@ -259,9 +331,8 @@ def is_safe_command(command: str) -> Tuple[bool, str]:
                 return False, "Dangerous rm command with recursive force and wildcards/root paths"
         
         # Check for absolute paths to critical directories
-        critical_paths = ['/', '/dev', '/sys', '/proc', '/etc', '/usr', '/var']
         for arg in cmd_parts[1:]:
-            if any(arg.startswith(path) for path in critical_paths):
+            if arg.startswith(CRITICAL_PATHS):
                 return False, f"Access to critical system path not allowed: {arg}"
         
         return True, "Command appears safe"
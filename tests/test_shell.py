@@ -0,0 +1,26 @@
+"""Tests for the shell command safety policy."""
+
+import pytest
+
+from agent.tools.shell import is_safe_command
+
+
+@pytest.mark.parametrize("command", [
+    "cat a#b /etc/shadow",
+    "cat # /etc/shadow",
+    "rm -r #x /usr",
+])
+def test_hash_does_not_hide_critical_paths(command):
+    safe, reason = is_safe_command(command)
+    assert not safe
+    assert "critical system path" in reason
+
+
+def test_quoted_pipe_is_an_argument():
+    assert is_safe_command('echo "a|b"')[0]
+
+
+def test_unspaced_pipe_is_checked():
+    safe, reason = is_safe_command("cat x|bash")
+    assert not safe
+    assert "bash" in reason
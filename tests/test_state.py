@@ -0,0 +1,63 @@
+"""Tests for the journaled agent state persistence."""
+
+from agent.state import StateManager
+
+
+def _populate(manager):
+    """Snapshot one TODO, then journal further adds and completions."""
+    state = manager.get_state()
+    state.add_todo("first", "snapshotted")
+    assert manager.save_state()
+    assert manager.state_file.exists()
+    assert not manager.journal_file.exists()
+    
+    state.add_todo("second")
+    state.add_todo("third", "stays open")
+    assert state.mark_todo_done(1)
+    assert state.mark_todo_done(2)
+    assert manager.save_state()
+    assert manager.journal_file.exists()
+    return state
+
+
+def _assert_same_state(original, reloaded):
+    assert [todo.model_dump() for todo in reloaded.todos] == [todo.model_dump() for todo in original.todos]
+    assert reloaded.next_todo_id == original.next_todo_id
+    assert [todo.id for todo in reloaded.get_active_todos()] == [3]
+    assert [todo.id for todo in reloaded.get_pending_todos()] == [3]
+    assert [todo.id for todo in reloaded.get_completed_todos()] == [1, 2]
+    assert reloaded.get_todo(2).completed == original.get_todo(2).completed
+
+
+def test_journal_replays_over_snapshot(tmp_path):
+    manager = StateManager(tmp_path / "state.json")
+    state = _populate(manager)
+    
+    reloaded = StateManager(tmp_path / "state.json").get_state()
+    _assert_same_state(state, reloaded)
+
+
+def test_reload_after_compact(tmp_path):
+    manager = StateManager(tmp_path / "state.json")
+    state = _populate(manager)
+    
+    assert manager.compact()
+    assert not manager.journal_file.exists()
+    
+    reloaded = StateManager(tmp_path / "state.json").get_state()
+    _assert_same_state(state, reloaded)
+
+
+def test_reloaded_index_accepts_new_changes(tmp_path):
+    manager = StateManager(tmp_path / "state.json")
+    _populate(manager)
+    
+    reloaded_manager = StateManager(tmp_path / "state.json")
+    reloaded = reloaded_manager.get_state()
+    assert reloaded.add_todo("fourth").id == 4
+    assert reloaded.mark_todo_done(3)
+    assert reloaded_manager.save_state()
+    
+    final = StateManager(tmp_path / "state.json").get_state()
+    assert [todo.id for todo in final.get_active_todos()] == [4]
+    assert [todo.id for todo in final.get_completed_todos()] == [1, 2, 3]